@@ -1,12 +1,35 @@
 """API客户端基类"""
 import asyncio
 import base64
+import json
 from typing import Dict, Any, Tuple, Optional
 from src.common.logger import get_logger
 
+try:
+    # 可选依赖：orjson 解析带大段base64的响应体明显快于标准库，且可直接接收bytes
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
 logger = get_logger("pic_action")
 
 
+def json_loads(data):
+    """解析JSON响应体，优先使用orjson
+
+    orjson.JSONDecodeError 继承自 json.JSONDecodeError，调用方按标准库异常捕获即可。
+
+    Args:
+        data: JSON字符串或bytes
+
+    Returns:
+        解析后的Python对象
+    """
+    if _orjson is not None:
+        return _orjson.loads(data)
+    return json.loads(data)
+
+
 class BaseApiClient:
     """API客户端基类"""
 
@@ -72,18 +95,16 @@ class BaseApiClient:
         Returns:
             MIME类型字符串
         """
-        # 移除data URI前缀（如果存在）
-        clean_base64 = image_base64
-        if ',' in image_base64:
-            clean_base64 = image_base64.split(',')[1]
+        # 跳过data URI前缀（如果存在），只需检查紧随其后的几个字符，无需复制整段数据
+        start = image_base64.find(',') + 1
 
-        if clean_base64.startswith('/9j/'):
+        if image_base64.startswith('/9j/', start):
             return "image/jpeg"
-        elif clean_base64.startswith('iVBORw'):
+        elif image_base64.startswith('iVBORw', start):
             return "image/png"
-        elif clean_base64.startswith('UklGR'):
+        elif image_base64.startswith('UklGR', start):
             return "image/webp"
-        elif clean_base64.startswith('R0lGOD'):
+        elif image_base64.startswith('R0lGOD', start):
             return "image/gif"
         else:
             return "image/jpeg"  # 默认
@@ -97,8 +118,10 @@ class BaseApiClient:
         Returns:
             纯base64数据
         """
-        if ',' in image_base64:
-            return image_base64.split(',')[1]
+        # 用find+切片代替split，避免为整段数据构建临时列表
+        comma = image_base64.find(',')
+        if comma >= 0:
+            return image_base64[comma + 1:]
         return image_base64
 
     async def generate_image(
@@ -4,10 +4,12 @@
 """
 import json
 import urllib.request
-import traceback
 from typing import Dict, Any, Tuple
 
-from .base_client import BaseApiClient, logger
+from .base_client import BaseApiClient, logger, json_loads
+
+# 常见的base64图片前缀（JPEG、PNG、WebP、GIF）
+_BASE64_IMAGE_PREFIXES = ('/9j/', 'iVBORw', 'UklGR', 'R0lGOD')
 
 
 class OpenAIClient(BaseApiClient):
@@ -171,7 +173,7 @@ class OpenAIClient(BaseApiClient):
                     logger.info(f"{self.log_prefix} (OpenAI) 详细调试 - 完整响应体: {cleaned_response}")
 
                 if 200 <= response_status < 300:
-                    response_data = json.loads(response_body_str)
+                    response_data = json_loads(response_body_bytes)
                     b64_data = None
                     image_url = None
 
@@ -211,7 +213,6 @@ class OpenAIClient(BaseApiClient):
                     return False, f"图片API请求失败(状态码 {response.status})"
         except Exception as e:
             logger.error(f"{self.log_prefix} (OpenAI) 图片生成时意外错误: {e!r}", exc_info=True)
-            traceback.print_exc()
             return False, f"图片生成HTTP请求时发生意外错误: {str(e)[:100]}"
 
     def _clean_response_body(self, response_body: str) -> str:
@@ -223,32 +224,34 @@ class OpenAIClient(BaseApiClient):
         Returns:
             清理后的响应体，base64数据被替换为占位符
         """
-        try:
-            # 如果响应体是JSON，尝试解析并替换b64_json字段
-            import json
-            data = json.loads(response_body)
-            if isinstance(data, dict):
-                # 检查是否有b64_json字段
-                if "data" in data and isinstance(data["data"], list) and len(data["data"]) > 0:
-                    for item in data["data"]:
-                        if isinstance(item, dict) and "b64_json" in item:
-                            item["b64_json"] = "[BASE64_DATA...]"
-                # 检查是否有images字段（魔搭格式）
-                if "images" in data and isinstance(data["images"], list) and len(data["images"]) > 0:
-                    for i, img in enumerate(data["images"]):
-                        if isinstance(img, dict) and "url" in img:
-                            # URL可以保留
-                            pass
-                # 重新序列化为字符串
-                return json.dumps(data, ensure_ascii=False)
-        except (json.JSONDecodeError, TypeError):
-            # 如果不是JSON，检查是否是纯base64图片数据
-            # 常见的base64图片前缀
-            base64_prefixes = ['/9j/', 'iVBORw', 'UklGR', 'R0lGOD']
-            if any(response_body.startswith(prefix) for prefix in base64_prefixes):
-                return "[BASE64_IMAGE_DATA...]"
-            # 如果包含很长的base64字符串（长度>500），截断
-            if len(response_body) > 500 and all(c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=' for c in response_body[:100]):
-                return f"[BASE64_DATA_LEN:{len(response_body)}]"
+        # 只有以 { 或 [ 开头的响应体才可能是JSON，其余直接按base64检查，省去一次必然失败的解析
+        if response_body.lstrip()[:1] in ('{', '['):
+            try:
+                # 尝试解析并替换b64_json字段
+                data = json_loads(response_body)
+                if isinstance(data, dict):
+                    # 检查是否有b64_json字段
+                    if "data" in data and isinstance(data["data"], list) and len(data["data"]) > 0:
+                        for item in data["data"]:
+                            if isinstance(item, dict) and "b64_json" in item:
+                                item["b64_json"] = "[BASE64_DATA...]"
+                    # 检查是否有images字段（魔搭格式）
+                    if "images" in data and isinstance(data["images"], list) and len(data["images"]) > 0:
+                        for i, img in enumerate(data["images"]):
+                            if isinstance(img, dict) and "url" in img:
+                                # URL可以保留
+                                pass
+                    # 重新序列化为字符串
+                    return json.dumps(data, ensure_ascii=False)
+                return response_body
+            except (json.JSONDecodeError, TypeError):
+                pass
+
+        # 不是JSON时，检查是否是纯base64图片数据
+        if response_body.startswith(_BASE64_IMAGE_PREFIXES):
+            return "[BASE64_IMAGE_DATA...]"
+        # 如果包含很长的base64字符串（长度>500），截断
+        if len(response_body) > 500 and all(c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=' for c in response_body[:100]):
+            return f"[BASE64_DATA_LEN:{len(response_body)}]"
         # 其他情况返回原样
         return response_body
@@ -4,12 +4,14 @@
 import json
 import re
 import urllib.request
-import traceback
 from typing import Dict, Any, Tuple, Optional
 
-from .base_client import BaseApiClient, logger
+from .base_client import BaseApiClient, logger, json_loads
 from ..size_utils import pixel_size_to_gemini_aspect
 
+# 常见的base64图片前缀（JPEG、PNG、WebP、GIF）
+_BASE64_IMAGE_PREFIXES = ("/9j/", "iVBORw", "UklGR", "R0lGOD")
+
 
 class ZaiClient(BaseApiClient):
     """Zai 平台（Gemini 转发）的 OpenAI 兼容客户端"""
@@ -103,7 +105,7 @@ class ZaiClient(BaseApiClient):
 
                 if 200 <= response_status < 300:
                     try:
-                        resp_json = json.loads(body_str)
+                        resp_json = json_loads(body_bytes)
                     except json.JSONDecodeError:
                         logger.error(f"{self.log_prefix} (Zai) 响应 JSON 解析失败")
                         return False, "响应解析失败"
@@ -136,7 +138,6 @@ class ZaiClient(BaseApiClient):
 
         except Exception as e:
             logger.error(f"{self.log_prefix} (Zai) 请求异常: {e!r}", exc_info=True)
-            traceback.print_exc()
             return False, f"HTTP 请求异常: {str(e)[:100]}"
 
     def _build_image_config(self, model_config: Dict[str, Any]) -> Dict[str, Optional[str]]:
@@ -221,5 +222,4 @@ class ZaiClient(BaseApiClient):
         if data.startswith("data:image"):
             return True
 
-        prefixes = ("/9j/", "iVBORw", "UklGR", "R0lGOD")
-        return any(data.startswith(p) for p in prefixes)
+        return data.startswith(_BASE64_IMAGE_PREFIXES)
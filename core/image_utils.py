@@ -1,62 +1,263 @@
 import asyncio
 import base64
+import binascii
 import json
-import urllib.request
-import traceback
 import re
 import os
+import time
+from collections import OrderedDict
 from functools import lru_cache
 from typing import Optional, Tuple, Dict, Any, Union, List
-from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
 
 from src.common.logger import get_logger
 from maim_message import Seg
 
+try:
+    # 可选依赖：pybase64 使用SIMD指令编码，处理MB级图片明显快于标准库，接口兼容
+    import pybase64 as _b64
+except ImportError:
+    _b64 = base64
+
+# 宿主的消息API和数据库模型在模块加载时导入一次，避免在每次检索时重复导入；
+# 缺失时对应的检索路径降级为不可用
+try:
+    from src.plugin_system.apis import message_api
+except ImportError:
+    message_api = None
+
+try:
+    from src.common.database.database_model import Messages
+except ImportError:
+    Messages = None
+
+# _get_message_by_id 需要读取的消息字段；只查询这些列，
+# 不同版本的Messages模型可能缺少部分字段，缺失的字段跳过
+_MESSAGE_FIELDS: Tuple[str, ...] = ('is_picid', 'processed_plain_text', 'display_message', 'additional_config', 'raw_message')
+_MESSAGE_COLUMNS = (
+    [Messages.id] + [getattr(Messages, field) for field in _MESSAGE_FIELDS if hasattr(Messages, field)]
+    if Messages is not None else []
+)
+
 logger = get_logger("pic_action")
 
+# base64图片数据的常见开头（data URL、JPEG、PNG、WebP、GIF）
+_IMG_PREFIXES: Tuple[str, ...] = ('data:image/', '/9j/', 'iVBOR', 'UklGR', 'R0lGO')
+_IMG_PREFIXES_B: Tuple[bytes, ...] = tuple(p.encode('ascii') for p in _IMG_PREFIXES)
+
+# 原始图片文件头魔数（PNG、JPEG、GIF、WebP/RIFF）
+# 不含BMP：两字节的"BM"过短，任意以"Qk"开头的base64文本都会被误判为图片
+_IMAGE_MAGIC_NUMBERS: Tuple[bytes, ...] = (b'\x89PNG', b'\xff\xd8\xff', b'GIF8', b'RIFF')
+
+# 从文本中嗅探base64图片数据的正则（模块加载时预编译）
+_DATA_URL_RE = re.compile(r'data:image/[^;]+;base64,([A-Za-z0-9+/=]+)')
+_BASE64_RUN_RE = re.compile(r'([A-Za-z0-9+/]{100,}={0,2})')
+
+# 嵌套图片数据中可能存放内容的键（按优先级排列）及最大嵌套深度
+_IMAGE_DATA_KEYS: Tuple[str, ...] = ('data', 'base64', 'content', 'image')
+_MAX_IMAGE_DATA_DEPTH = 32
+
+# 消息中可能携带被回复消息的字段，以及可能包含回复格式文本的字段
+_REPLY_FIELDS: Tuple[str, ...] = ('reply_message', 'quoted_message', 'reply')
+_TEXT_FIELDS: Tuple[str, ...] = ('processed_plain_text', 'display_message', 'raw_message', 'message_content')
+# 判断是否为回复消息时还需检查reply_to字段
+_REPLY_CHECK_FIELDS: Tuple[str, ...] = ('reply_to',) + _REPLY_FIELDS
+
+# API响应中存放图片数据的字段（顶层 / output 嵌套结构）
+_RESPONSE_KEYS: Tuple[str, ...] = ('url', 'image', 'b64_json', 'data')
+_RESPONSE_OUTPUT_KEYS: Tuple[str, ...] = ('image_url', 'images')
+
+# 下载图片时每次读取的块大小
+_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+# 下载图片的总超时时间
+_DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=600)
+
+
+def _as_text(value: Any) -> str:
+    """取出消息字段中的文本，只接受str/bytes，其余类型视为无文本
+
+    避免对字典、列表等富结构调用str()生成完整的repr。
+    """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', 'ignore')
+    return ''
+
+
+def _as_sequence(messages) -> Union[list, tuple]:
+    """将历史消息查询结果规整为可索引的序列，非list/tuple的结果只缓冲一次"""
+    if isinstance(messages, (list, tuple)):
+        return messages
+    return list(messages) if messages else []
+
+
+def _get_field(message: Any, key: str, default: Any = None) -> Any:
+    """读取消息字段，兼容字典和DatabaseMessages对象"""
+    if isinstance(message, dict):
+        return message.get(key, default)
+    return getattr(message, key, default)
+
+
+def _message_key(message: Any) -> str:
+    """取消息的ID并规整为字符串，兼容字典和DatabaseMessages对象"""
+    return str(_get_field(message, 'message_id') or _get_field(message, 'id'))
+
+
+def _index_messages_by_id(messages) -> Dict[str, Any]:
+    """按消息ID为历史消息建立索引，ID相同时保留最早出现的消息"""
+    index = {}
+    for msg in messages:
+        index.setdefault(_message_key(msg), msg)
+    return index
+
+
+def _query_message_by_id(message_id: str) -> Optional[dict]:
+    """按ID查询消息记录并转换为字典，未查到时返回None
+
+    只查询 _MESSAGE_COLUMNS 中的列，dicts() 直接返回字典行，省去构造模型实例和再次拷贝。
+    同步执行数据库查询，在协程中应通过线程调用。
+    """
+    return Messages.select(*_MESSAGE_COLUMNS).where(Messages.id == message_id).dicts().first()
+
+
+def encode_base64(data: bytes) -> str:
+    """将二进制数据编码为base64字符串，优先使用pybase64"""
+    return _b64.b64encode(data).decode('ascii')
+
+
+def _is_valid_base64_head(data: Union[str, bytes, bytearray]) -> bool:
+    """校验base64数据（或data URL中的base64部分）开头能否正常解码
+
+    与 _is_image_data 的判断保持一致：data URL 可以出现在开头部分的任意位置，
+    base64数据前允许有空白或少量文本，从匹配到的位置开始校验。
+    只解码开头的64个字符，提前拒绝格式错误的数据，避免下游解码整段数据后才失败。
+    """
+    window = data[:256]
+    if not isinstance(window, str):
+        try:
+            window = bytes(window).decode('ascii')
+        except UnicodeDecodeError:
+            return False
+
+    marker = window.find(';base64,')
+    if marker >= 0:
+        start = marker + len(';base64,')
+    else:
+        positions = [pos for pos in (window.find(prefix) for prefix in _IMG_PREFIXES) if pos >= 0]
+        start = min(positions) if positions else len(window) - len(window.lstrip())
+    head = window[start:start + 64]
+    try:
+        base64.b64decode(head + '=' * (-len(head) % 4), validate=True)
+        return True
+    except (binascii.Error, ValueError):
+        return False
+
+
+@lru_cache(maxsize=512)
+def _is_base64_image_head(head: str) -> bool:
+    """检查base64字符串开头是否为合法字符且解码后是图片文件头
+
+    只接收截取的开头部分，缓存键长度有界，不会把整段base64数据留在缓存里。
+    """
+    if not all(c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=' for c in head):
+        return False
+    # 尝试解码前几个字符看是否是图片格式
+    try:
+        return base64.b64decode(head).startswith(_IMAGE_MAGIC_NUMBERS)
+    except Exception:
+        return False
+
+
+@lru_cache(maxsize=8)
+def load_image_base64(image_path: str, mtime_ns: int) -> str:
+    """读取本地图片文件并编码为base64
+
+    以(路径, 修改时间)为缓存键，文件被修改后缓存自动失效。
+
+    Args:
+        image_path: 图片文件路径
+        mtime_ns: 文件的修改时间（纳秒），仅用作缓存键
+
+    Returns:
+        图片的base64编码
+    """
+    with open(image_path, 'rb') as f:
+        return encode_base64(f.read())
+
+
+def read_image_base64(image_path: str) -> str:
+    """读取本地图片的base64编码，按文件修改时间复用缓存结果
+
+    文件不存在时抛出FileNotFoundError。该函数会进行磁盘IO，在协程中应通过线程调用。
+    """
+    return load_image_base64(image_path, os.stat(image_path).st_mtime_ns)
+
+
 class ImageProcessor:
     """图片处理工具类"""
 
-    # 图片格式检测模式
-    _image_format_patterns = {
-        'jpeg': ['/9j/', '\xff\xd8\xff'],
-        'png': ['iVBORw', '\x89PNG'],
-        'webp': ['UklGR', 'RIFF'],
-        'gif': ['R0lGOD', 'GIF8']
-    }
+    # 每个组件实例都会创建一个处理器，属性固定，使用__slots__省去实例字典
+    __slots__ = (
+        'action',
+        'log_prefix',
+        '_kind',
+        '_failed_picids_cache',
+        '_max_failed_cache_size',
+        '_failed_cache_ttl',
+    )
 
     def __init__(self, action_instance):
         self.action = action_instance
         self.log_prefix = action_instance.log_prefix
 
+        # 组件类型在构造时判断一次，后续分派不再逐次探测属性
+        if hasattr(action_instance, 'has_action_message'):
+            self._kind = 'action'
+        elif hasattr(action_instance, 'message'):
+            self._kind = 'command'
+        else:
+            self._kind = 'unknown'
+
         # 使用实例级别的失败缓存，避免跨实例状态共享问题
-        self._failed_picids_cache = {}
+        # OrderedDict 按访问顺序排列，队首即最久未使用的条目
+        self._failed_picids_cache: OrderedDict = OrderedDict()
         self._max_failed_cache_size = 500
+        self._failed_cache_ttl = 600  # 失败记录有效期（秒），过期后允许重试
 
     def _is_picid_failed(self, picid: str) -> bool:
         """检查picid是否在失败缓存中"""
-        return picid in self._failed_picids_cache
+        failed_at = self._failed_picids_cache.get(picid)
+        if failed_at is None:
+            return False
+
+        # 过期的失败记录直接移除，允许重新尝试
+        if time.monotonic() - failed_at > self._failed_cache_ttl:
+            del self._failed_picids_cache[picid]
+            return False
+
+        self._failed_picids_cache.move_to_end(picid)
+        return True
 
     def _mark_picid_failed(self, picid: str):
         """将picid标记为失败，使用LRU缓存机制"""
-        import time
-        self._failed_picids_cache[picid] = time.time()
+        self._failed_picids_cache[picid] = time.monotonic()
+        self._failed_picids_cache.move_to_end(picid)
 
-        # LRU清理机制
-        if len(self._failed_picids_cache) > self._max_failed_cache_size:
-            # 按时间排序，移除最旧的条目
-            sorted_items = sorted(self._failed_picids_cache.items(), key=lambda x: x[1])
-            items_to_remove = len(sorted_items) - self._max_failed_cache_size // 2
-            for i in range(items_to_remove):
-                del self._failed_picids_cache[sorted_items[i][0]]
+        # LRU清理机制：超出上限时从队首淘汰最久未使用的条目
+        while len(self._failed_picids_cache) > self._max_failed_cache_size:
+            self._failed_picids_cache.popitem(last=False)
 
     def _is_action_component(self) -> bool:
         """判断是否为Action组件"""
-        return hasattr(self.action, 'has_action_message')
+        return self._kind == 'action'
 
     def _is_command_component(self) -> bool:
         """判断是否为Command组件"""
-        return hasattr(self.action, 'message')
+        return self._kind == 'command'
 
     async def get_recent_image(self) -> Optional[str]:
         """获取最近的图片消息，支持多种组件类型"""
@@ -67,12 +268,10 @@ class ImageProcessor:
             message_segments = None
 
             # 兼容Action和Command组件
-            if hasattr(self.action, 'message') and hasattr(self.action.message, 'message_segment'):
-                # Command组件
-                message_segments = self.action.message.message_segment
-            elif hasattr(self.action, 'action_message') and hasattr(self.action.action_message, 'message_segment'):
-                # Action组件
-                message_segments = self.action.action_message.message_segment
+            if self._kind == 'command':
+                message_segments = getattr(self.action.message, 'message_segment', None)
+            elif self._kind == 'action':
+                message_segments = getattr(getattr(self.action, 'action_message', None), 'message_segment', None)
 
             if message_segments:
                 # 使用emoji插件的检索功能
@@ -83,24 +282,16 @@ class ImageProcessor:
 
             # 方法2：从历史消息中查找（作为后备）
             try:
-                from src.plugin_system.apis import message_api
-
                 # 获取chat_id
                 chat_id = self._get_chat_id()
-                if chat_id:
+                if chat_id and message_api is not None:
                     # 获取最近的消息
-                    recent_messages = message_api.get_recent_messages(chat_id, hours=1.0, limit=15, filter_mai=True)
+                    recent_messages = await self._get_recent_messages(chat_id, hours=1.0, limit=15)
                     logger.debug(f"{self.log_prefix} 从历史消息获取到 {len(recent_messages)} 条消息")
 
-                    for msg in reversed(recent_messages):
+                    for msg in recent_messages[::-1]:
                         # 检查消息是否包含图片标记
-                        is_picid = False
-                        if isinstance(msg, dict):
-                            is_picid = msg.get('is_picid', False)
-                        else:
-                            is_picid = getattr(msg, 'is_picid', False)
-
-                        if is_picid:
+                        if _get_field(msg, 'is_picid', False):
                             # 尝试从消息段中提取
                             if hasattr(msg, 'message_segment') and msg.message_segment:
                                 emoji_base64_list = self.find_and_return_emoji_in_message(msg.message_segment)
@@ -120,27 +311,24 @@ class ImageProcessor:
 
     def _get_action_message(self) -> Optional[Any]:
         """获取action_message对象，兼容Action和Command"""
-        if hasattr(self.action, 'has_action_message') and self.action.has_action_message:
-            # Action组件
-            return self.action.action_message
-        elif hasattr(self.action, 'message') and hasattr(self.action.message, 'message_recv'):
+        if self._kind == 'action':
+            return self.action.action_message if self.action.has_action_message else None
+        if self._kind == 'command':
             # Command组件，使用message.message_recv作为action_message
-            return self.action.message.message_recv
+            return getattr(self.action.message, 'message_recv', None)
         return None
 
     def _get_chat_stream(self) -> Optional[Any]:
         """获取chat_stream对象，兼容Action和Command"""
-        if hasattr(self.action, 'chat_stream') and self.action.chat_stream:
-            # Action组件
-            return self.action.chat_stream
-        elif hasattr(self.action, 'message') and hasattr(self.action.message, 'chat_stream'):
-            # Command组件
-            return self.action.message.chat_stream
+        if self._kind == 'action':
+            return getattr(self.action, 'chat_stream', None) or None
+        if self._kind == 'command':
+            return getattr(self.action.message, 'chat_stream', None)
         return None
 
     def _get_chat_id(self) -> Optional[str]:
         """获取chat_id，兼容Action和Command"""
-        if hasattr(self.action, 'chat_id'):
+        if self._kind == 'action' and hasattr(self.action, 'chat_id'):
             # Action组件
             return self.action.chat_id
 
@@ -152,32 +340,40 @@ class ImageProcessor:
     def _process_image_data(self, data) -> Optional[str]:
         """处理图片数据，统一转换为base64格式"""
         try:
-            if not data:
-                return None
-
-            # 如果是字符串类型
-            if isinstance(data, str):
-                # 检查是否是有效的base64图片数据
-                if self._is_image_data(data):
-                    return data
-                # 如果不是，可能需要其他处理
-                return None
-
-            # 如果是字典类型，尝试提取内部数据
-            if isinstance(data, dict):
-                for key in ['data', 'base64', 'content', 'image']:
-                    if key in data and data[key]:
-                        result = self._process_image_data(data[key])
-                        if result:
-                            return result
-
-            # 如果是字节类型，转换为base64
-            if isinstance(data, bytes):
-                try:
-                    return base64.b64encode(data).decode('utf-8')
-                except Exception as e:
-                    logger.debug(f"{self.log_prefix} 字节数据转base64失败: {e}")
-                    return None
+            # 使用显式栈做深度优先遍历，避免对嵌套字典逐层递归；
+            # 栈中记录每项的嵌套深度，自引用或嵌套过深的数据在超过上限时停止解析
+            stack = [(data, 0)]
+            while stack:
+                current, depth = stack.pop()
+                if not current:
+                    continue
+
+                # 字节数据：常见图片文件头直接编码一次；
+                # 以ASCII字节形式存放的base64文本直接解码，避免重复编码；其余字节按原样转换为base64
+                if isinstance(current, (bytes, bytearray, memoryview)):
+                    if bytes(current[:12]).startswith(_IMAGE_MAGIC_NUMBERS):
+                        return encode_base64(current)
+                    if self._is_image_data(current) and _is_valid_base64_head(current):
+                        return bytes(current).decode('ascii')
+                    return encode_base64(current)
+
+                # 如果是字符串类型，检查是否是有效的base64图片数据
+                if isinstance(current, str):
+                    if self._is_image_data(current) and _is_valid_base64_head(current):
+                        return current
+                    continue
+
+                # 如果是字典类型，尝试提取内部数据
+                if isinstance(current, dict):
+                    if depth >= _MAX_IMAGE_DATA_DEPTH:
+                        logger.debug(f"{self.log_prefix} 图片数据嵌套过深，停止解析")
+                        return None
+                    # 逆序入栈，保证按键的优先级顺序出栈
+                    for key in reversed(_IMAGE_DATA_KEYS):
+                        value = current.get(key)
+                        if value:
+                            stack.append((value, depth + 1))
+                    continue
 
             return None
 
@@ -185,31 +381,27 @@ class ImageProcessor:
             logger.debug(f"{self.log_prefix} 处理图片数据失败: {str(e)[:50]}")
             return None
 
-    def _is_image_data(self, data: str) -> bool:
+    def _is_image_data(self, data: Union[str, bytes]) -> bool:
         """检查字符串是否是有效的base64图片数据"""
         try:
-            if not isinstance(data, str) or len(data) < 100:
+            if len(data) < 100:
                 return False
 
-            # 检查是否包含base64图片前缀
-            if any(prefix in data[:50] for prefix in ['data:image/', '/9j/', 'iVBOR', 'UklGR', 'R0lGO']):
-                return True
+            # 已编码为ASCII字节的base64数据，直接做字节级前缀查找
+            if isinstance(data, (bytes, bytearray)):
+                head = data[:50]
+                return any(prefix in head for prefix in _IMG_PREFIXES_B)
 
-            # 检查base64格式特征
-            if len(data) % 4 == 0 and all(c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=' for c in data[:100]):
-                # 尝试解码前几个字符看是否是图片格式
-                try:
-                    decoded_start = base64.b64decode(data[:100])
-                    for format_name, patterns in self._image_format_patterns.items():
-                        for pattern in patterns:
-                            if isinstance(pattern, str) and decoded_start.startswith(pattern.encode()):
-                                return True
-                            elif isinstance(pattern, bytes) and decoded_start.startswith(pattern):
-                                return True
-                except Exception:
-                    pass
+            if not isinstance(data, str):
+                return False
 
-            return False
+            # 检查开头部分是否包含base64图片前缀
+            head = data[:50]
+            if any(prefix in head for prefix in _IMG_PREFIXES):
+                return True
+
+            # 检查base64格式特征，只取开头部分作为缓存键
+            return len(data) % 4 == 0 and _is_base64_image_head(data[:100])
 
         except Exception:
             return False
@@ -222,7 +414,7 @@ class ImageProcessor:
         except (ValueError, TypeError):
             return False
 
-    def download_and_encode_base64(self, image_url: str) -> Tuple[bool, str]:
+    async def download_and_encode_base64(self, image_url: str) -> Tuple[bool, str]:
         """下载图片或处理Base64数据URL"""
         logger.info(f"{self.log_prefix} (B64) 处理图片: {image_url[:50]}...")
         
@@ -232,8 +424,9 @@ class ImageProcessor:
                 logger.info(f"{self.log_prefix} (B64) 检测到Base64数据URL")
                 
                 # 从数据URL中提取Base64部分
-                if ';base64,' in image_url:
-                    base64_data = image_url.split(';base64,', 1)[1]
+                marker = image_url.find(';base64,')
+                if marker >= 0:
+                    base64_data = image_url[marker + len(';base64,'):]
                     logger.info(f"{self.log_prefix} (B64) 从数据URL提取Base64完成. 长度: {len(base64_data)}")
                     return True, base64_data
                 else:
@@ -241,24 +434,53 @@ class ImageProcessor:
                     logger.error(f"{self.log_prefix} (B64) {error_msg}")
                     return False, error_msg
             else:
-                # 处理普通HTTP URL
+                # 处理普通HTTP URL，异步下载不阻塞事件循环
                 logger.info(f"{self.log_prefix} (B64) 下载HTTP图片")
-                with urllib.request.urlopen(image_url, timeout=600) as response:
-                    if response.status == 200:
-                        image_bytes = response.read()
-                        base64_encoded_image = base64.b64encode(image_bytes).decode("utf-8")
-                        logger.info(f"{self.log_prefix} (B64) 图片下载编码完成. Base64长度: {len(base64_encoded_image)}")
-                        return True, base64_encoded_image
-                    else:
-                        error_msg = f"下载图片失败 (状态: {response.status})"
-                        logger.error(f"{self.log_prefix} (B64) {error_msg} URL: {image_url[:30]}...")
-                        return False, error_msg
+                # 每次下载使用独立会话，退出时自动关闭，插件卸载后不会残留未关闭的连接
+                async with aiohttp.ClientSession(timeout=_DOWNLOAD_TIMEOUT, trust_env=True) as session:
+                    async with session.get(image_url, proxy=self._get_download_proxy()) as response:
+                        if response.status == 200:
+                            base64_encoded_image = await self._encode_response_base64(response)
+                            logger.info(f"{self.log_prefix} (B64) 图片下载编码完成. Base64长度: {len(base64_encoded_image)}")
+                            return True, base64_encoded_image
+                        else:
+                            error_msg = f"下载图片失败 (状态: {response.status})"
+                            logger.error(f"{self.log_prefix} (B64) {error_msg} URL: {image_url[:30]}...")
+                            return False, error_msg
                         
         except Exception as e:
             logger.error(f"{self.log_prefix} (B64) 处理图片时错误: {e!r}", exc_info=True)
-            traceback.print_exc()
             return False, f"处理图片时发生错误: {str(e)[:50]}"
 
+    def _get_download_proxy(self) -> Optional[str]:
+        """获取下载图片使用的代理地址，未启用代理时返回None"""
+        try:
+            if not self.action.get_config("proxy.enabled", False):
+                return None
+            return self.action.get_config("proxy.url", "http://127.0.0.1:7890")
+        except Exception as e:
+            logger.warning(f"{self.log_prefix} 获取代理配置失败: {e}, 将不使用代理")
+            return None
+
+    @staticmethod
+    async def _encode_response_base64(response) -> str:
+        """分块读取HTTP响应体并流式编码为Base64
+
+        每次只对按3字节对齐的部分编码，不足3字节的尾部留到下一块，编码结果直接追加到同一个缓冲区，
+        不保留完整的原始数据。最后解码为字符串时缓冲区与结果同时存在，峰值内存约为响应体的2.7倍。
+        """
+        encoded = bytearray()
+        leftover = b''
+        async for chunk in response.content.iter_chunked(_DOWNLOAD_CHUNK_SIZE):
+            if leftover:
+                chunk = leftover + chunk
+            aligned = len(chunk) - len(chunk) % 3
+            encoded += _b64.b64encode(chunk[:aligned])
+            leftover = chunk[aligned:]
+        if leftover:
+            encoded += _b64.b64encode(leftover)
+        return encoded.decode('ascii')
+
     def process_api_response(self, result) -> Optional[str]:
         """统一处理API响应，提取图片数据"""
         try:
@@ -269,17 +491,15 @@ class ImageProcessor:
             # 如果result是字典，尝试提取图片数据
             if isinstance(result, dict):
                 # 尝试多种可能的字段
-                for key in ['url', 'image', 'b64_json', 'data']:
-                    if key in result and result[key]:
-                        return result[key]
+                value = next((result[key] for key in _RESPONSE_KEYS if result.get(key)), None)
+                if value:
+                    return value
 
                 # 检查嵌套结构
-                if 'output' in result and isinstance(result['output'], dict):
-                    output = result['output']
-                    for key in ['image_url', 'images']:
-                        if key in output:
-                            data = output[key]
-                            return data[0] if isinstance(data, list) and data else data
+                output = result.get('output')
+                if isinstance(output, dict):
+                    data = next((output[key] for key in _RESPONSE_OUTPUT_KEYS if output.get(key)), None)
+                    return data[0] if isinstance(data, list) and data else data
 
             return None
         except Exception as e:
@@ -293,37 +513,18 @@ class ImageProcessor:
                 return False
 
             # 检查结构化的回复字段
-            reply_fields = ['reply_to', 'reply_message', 'quoted_message', 'reply']
-            if isinstance(action_message, dict):
-                for field in reply_fields:
-                    if field in action_message and action_message[field]:
-                        logger.debug(f"{self.log_prefix} 检测到回复字段: {field} = {action_message[field]}")
-                        return True
-            else:
-                # DatabaseMessages 对象
-                for field in reply_fields:
-                    reply_value = getattr(action_message, field, None)
-                    if reply_value:
-                        logger.debug(f"{self.log_prefix} 检测到回复属性: {field} = {reply_value}")
-                        return True
+            for field in _REPLY_CHECK_FIELDS:
+                reply_value = _get_field(action_message, field)
+                if reply_value:
+                    logger.debug(f"{self.log_prefix} 检测到回复字段: {field} = {reply_value}")
+                    return True
 
             # 检查文本内容中的回复格式
-            text_fields = ['processed_plain_text', 'display_message', 'raw_message', 'message_content']
-
-            if isinstance(action_message, dict):
-                for field in text_fields:
-                    if field in action_message:
-                        text = str(action_message[field])
-                        if text and '[回复' in text and ']' in text:
-                            logger.debug(f"{self.log_prefix} 在字段 {field} 中检测到回复消息格式")
-                            return True
-            else:
-                # DatabaseMessages 对象
-                for field in text_fields:
-                    text = str(getattr(action_message, field, ''))
-                    if text and '[回复' in text and ']' in text:
-                        logger.debug(f"{self.log_prefix} 在属性 {field} 中检测到回复消息格式")
-                        return True
+            for field in _TEXT_FIELDS:
+                text = _as_text(_get_field(action_message, field))
+                if text and '[回复' in text and ']' in text:
+                    logger.debug(f"{self.log_prefix} 在字段 {field} 中检测到回复消息格式")
+                    return True
 
             return False
 
@@ -338,29 +539,19 @@ class ImageProcessor:
                 return None
 
             # 1. 处理reply_to字段
-            reply_to = None
-            if isinstance(action_message, dict):
-                if 'reply_to' in action_message and action_message['reply_to']:
-                    reply_to = action_message['reply_to']
-            else:
-                # DatabaseMessages 对象
-                reply_to = getattr(action_message, 'reply_to', None)
+            reply_to = _get_field(action_message, 'reply_to')
 
             if reply_to:
                 logger.info(f"{self.log_prefix} 发现reply_to字段: {reply_to}")
+                # 消息ID统一按字符串比较，只转换一次
+                reply_key = str(reply_to)
 
                 # 尝试通过消息ID直接查询被回复的消息
                 reply_message = await self._get_message_by_id(reply_to)
                 if reply_message:
                     logger.info(f"{self.log_prefix} 通过ID获取到被回复的消息")
                     # 检查是否是图片消息
-                    is_picid = False
-                    if isinstance(reply_message, dict):
-                        is_picid = reply_message.get('is_picid', False)
-                    else:
-                        is_picid = getattr(reply_message, 'is_picid', False)
-
-                    if is_picid:
+                    if _get_field(reply_message, 'is_picid', False):
                         image_data = await self._extract_image_from_message(reply_message)
                         if image_data:
                             logger.info(f"{self.log_prefix} 从reply_to消息获取图片成功")
@@ -368,120 +559,67 @@ class ImageProcessor:
 
                 # 如果直接查询失败，在历史消息中搜索
                 try:
-                    from src.plugin_system.apis import message_api
-
                     chat_id = self._get_chat_id()
-                    if chat_id:
+                    msg = None
+                    if chat_id and message_api is not None:
                         # 获取更多历史消息来查找被回复的消息
-                        recent_messages = message_api.get_recent_messages(chat_id, hours=2.0, limit=50, filter_mai=True)
+                        recent_messages = await self._get_recent_messages(chat_id, hours=2.0, limit=50)
                         logger.debug(f"{self.log_prefix} 获取 {len(recent_messages)} 条消息查找reply_to: {reply_to}")
 
-                        for msg in recent_messages:
-                            # 检查消息ID匹配
-                            msg_id = None
-                            is_picid = False
-
-                            if isinstance(msg, dict):
-                                msg_id = msg.get('message_id') or msg.get('id')
-                                is_picid = msg.get('is_picid', False)
-                            else:
-                                # DatabaseMessages 对象
-                                msg_id = getattr(msg, 'message_id', None) or getattr(msg, 'id', None)
-                                is_picid = getattr(msg, 'is_picid', False)
-
-                            if str(msg_id) == str(reply_to):
-                                logger.info(f"{self.log_prefix} 在历史消息中找到被回复的消息: {msg_id}")
-                                # 检查这条消息是否包含图片
-                                if is_picid:
-                                    image_data = await self._extract_image_from_message(msg)
-                                    if image_data:
-                                        logger.info(f"{self.log_prefix} 从reply_to消息获取图片成功")
-                                        return image_data
+                        # 按消息ID建立索引，一次查找代替逐条比较
+                        msg = _index_messages_by_id(recent_messages).get(reply_key)
+
+                    if msg is not None:
+                        logger.info(f"{self.log_prefix} 在历史消息中找到被回复的消息: {reply_to}")
+                        # 检查这条消息是否包含图片
+                        if _get_field(msg, 'is_picid', False):
+                            image_data = await self._extract_image_from_message(msg)
+                            if image_data:
+                                logger.info(f"{self.log_prefix} 从reply_to消息获取图片成功")
+                                return image_data
 
                 except Exception as e:
                     logger.debug(f"{self.log_prefix} 通过reply_to查找消息失败: {e}")
 
             # 2. 尝试从回复相关字段直接获取
-            reply_fields = ['reply_message', 'quoted_message', 'reply']
-            if isinstance(action_message, dict):
-                for field in reply_fields:
-                    if field in action_message and action_message[field]:
-                        reply_data = action_message[field]
-                        image_data = await self._extract_image_from_message(reply_data)
-                        if image_data:
-                            logger.info(f"{self.log_prefix} 从{field}字段获取回复图片")
-                            return image_data
-            else:
-                # DatabaseMessages 对象
-                for field in reply_fields:
-                    reply_data = getattr(action_message, field, None)
-                    if reply_data:
-                        image_data = await self._extract_image_from_message(reply_data)
-                        if image_data:
-                            logger.info(f"{self.log_prefix} 从{field}属性获取回复图片")
-                            return image_data
+            for field in _REPLY_FIELDS:
+                reply_data = _get_field(action_message, field)
+                if reply_data:
+                    image_data = await self._extract_image_from_message(reply_data)
+                    if image_data:
+                        logger.info(f"{self.log_prefix} 从{field}字段获取回复图片")
+                        return image_data
 
             # 3. 解析回复格式的文本消息，提取被回复消息的ID或信息
-            text_fields = ['processed_plain_text', 'display_message', 'raw_message', 'message_content']
-            if isinstance(action_message, dict):
-                for field in text_fields:
-                    if field in action_message:
-                        text = str(action_message[field])
-                        if '[回复' in text and '[图片]' in text:
-                            logger.debug(f"{self.log_prefix} 在{field}中发现回复图片格式: {text[:100]}...")
-
-                            # 尝试从文本中提取图片相关信息
-                            image_data = await self._extract_base64_from_text(text)
-                            if image_data:
-                                logger.info(f"{self.log_prefix} 从回复文本中提取图片成功")
-                                return image_data
-            else:
-                # DatabaseMessages 对象
-                for field in text_fields:
-                    text = str(getattr(action_message, field, ''))
-                    if '[回复' in text and '[图片]' in text:
-                        logger.debug(f"{self.log_prefix} 在{field}属性中发现回复图片格式: {text[:100]}...")
-
-                        # 尝试从文本中提取图片相关信息
-                        image_data = await self._extract_base64_from_text(text)
-                        if image_data:
-                            logger.info(f"{self.log_prefix} 从回复文本中提取图片成功")
-                            return image_data
+            for field in _TEXT_FIELDS:
+                text = _as_text(_get_field(action_message, field))
+                if '[回复' in text and '[图片]' in text:
+                    logger.debug(f"{self.log_prefix} 在{field}中发现回复图片格式: {text[:100]}...")
+
+                    # 尝试从文本中提取图片相关信息
+                    image_data = await self._extract_base64_from_text(text)
+                    if image_data:
+                        logger.info(f"{self.log_prefix} 从回复文本中提取图片成功")
+                        return image_data
 
             # 4. 作为备选方案，查找最近的图片消息（但要确保时间匹配）
             try:
-                from src.plugin_system.apis import message_api
-
                 chat_id = self._get_chat_id()
-                if chat_id:
+                if chat_id and message_api is not None:
                     # 限制搜索范围到30条消息，30分钟内，确保时效性
-                    recent_messages = message_api.get_recent_messages(chat_id, hours=0.5, limit=30, filter_mai=True)
+                    recent_messages = await self._get_recent_messages(chat_id, hours=0.5, limit=30)
                     logger.debug(f"{self.log_prefix} 限制搜索范围，获取最近 {len(recent_messages)} 条消息查找图片")
 
-                    for msg in reversed(recent_messages):
-                        # 跳过当前消息
-                        current_msg_id = None
-                        msg_id = None
-                        is_picid = False
-
-                        if isinstance(action_message, dict):
-                            current_msg_id = action_message.get('message_id') or action_message.get('id')
-                        else:
-                            current_msg_id = getattr(action_message, 'message_id', None) or getattr(action_message, 'id', None)
+                    # 当前消息的ID只需计算一次
+                    current_key = _message_key(action_message)
 
-                        if isinstance(msg, dict):
-                            msg_id = msg.get('message_id') or msg.get('id')
-                            is_picid = msg.get('is_picid', False)
-                        else:
-                            # DatabaseMessages 对象
-                            msg_id = getattr(msg, 'message_id', None) or getattr(msg, 'id', None)
-                            is_picid = getattr(msg, 'is_picid', False)
-
-                        if str(msg_id) == str(current_msg_id):
+                    for msg in recent_messages[::-1]:
+                        # 跳过当前消息
+                        if _message_key(msg) == current_key:
                             continue
 
                         # 查找图片消息
-                        if is_picid:
+                        if _get_field(msg, 'is_picid', False):
                             image_data = await self._extract_image_from_message(msg)
                             if image_data:
                                 logger.warning(f"{self.log_prefix} 使用备选方案：从最近历史消息中获取图片，可能不是被回复的原图")
@@ -496,27 +634,28 @@ class ImageProcessor:
             logger.error(f"{self.log_prefix} 从回复消息获取图片失败: {e!r}")
             return None
 
+    async def _get_recent_messages(self, chat_id: str, hours: float, limit: int) -> Union[list, tuple]:
+        """获取会话的最近历史消息
+
+        数据库查询为同步阻塞调用，放到线程中执行避免阻塞事件循环。
+        """
+        return _as_sequence(await asyncio.to_thread(
+            message_api.get_recent_messages, chat_id, hours=hours, limit=limit, filter_mai=True
+        ))
+
     async def _get_message_by_id(self, message_id: str) -> Optional[dict]:
         """通过消息ID直接查询消息"""
         try:
             # 尝试使用数据库直接查询
-            from src.common.database.database_model import Messages
+            if Messages is None:
+                logger.debug(f"{self.log_prefix} 数据库模型不可用，无法通过ID查询消息")
+                return None
 
             try:
-                # 查询消息记录
-                message_record = Messages.select().where(Messages.id == message_id).first()
-                if message_record:
+                # 数据库查询为同步阻塞调用，连同记录转换一起放到线程中执行
+                message_dict = await asyncio.to_thread(_query_message_by_id, message_id)
+                if message_dict:
                     logger.info(f"{self.log_prefix} 通过数据库查询到消息: {message_id}")
-                    # 将消息记录转换为字典格式
-                    message_dict = {
-                        'id': message_record.id,
-                        'message_id': message_record.id,
-                        'is_picid': getattr(message_record, 'is_picid', False),
-                        'processed_plain_text': getattr(message_record, 'processed_plain_text', ''),
-                        'display_message': getattr(message_record, 'display_message', ''),
-                        'additional_config': getattr(message_record, 'additional_config', ''),
-                        'raw_message': getattr(message_record, 'raw_message', ''),
-                    }
                     return message_dict
             except Exception as e:
                 logger.debug(f"{self.log_prefix} 数据库查询消息失败: {e}")
@@ -533,28 +672,22 @@ class ImageProcessor:
         """从消息中查找并返回表情包/图片的base64数据列表 (来自emoji_manage插件)"""
         emoji_base64_list = []
 
-        # 处理单个Seg对象的情况
-        if isinstance(message_segments, Seg):
-            if message_segments.type == "emoji":
-                emoji_base64_list.append(message_segments.data)
-            elif message_segments.type == "image":
-                # 假设图片数据是base64编码的
-                emoji_base64_list.append(message_segments.data)
-            elif message_segments.type == "seglist":
-                # 递归处理嵌套的Seg列表
-                emoji_base64_list.extend(self.find_and_return_emoji_in_message(message_segments.data))
-            return emoji_base64_list
-
-        # 处理Seg列表的情况
-        for seg in message_segments:
+        # 使用显式栈遍历嵌套的seglist，避免逐层递归；逆序入栈以保持消息段原有顺序
+        stack = [message_segments] if isinstance(message_segments, Seg) else list(reversed(message_segments))
+        while stack:
+            seg = stack.pop()
             if seg.type == "emoji":
                 emoji_base64_list.append(seg.data)
             elif seg.type == "image":
                 # 假设图片数据是base64编码的
                 emoji_base64_list.append(seg.data)
             elif seg.type == "seglist":
-                # 递归处理嵌套的Seg列表
-                emoji_base64_list.extend(self.find_and_return_emoji_in_message(seg.data))
+                # 嵌套的Seg列表，子段入栈继续处理
+                children = seg.data
+                if isinstance(children, Seg):
+                    stack.append(children)
+                else:
+                    stack.extend(reversed(children))
         return emoji_base64_list
 
     async def _extract_image_from_message(self, message) -> Optional[str]:
@@ -564,11 +697,7 @@ class ImageProcessor:
                 return None
 
             # 如果消息有message_segment，直接从中提取
-            message_segment = None
-            if isinstance(message, dict):
-                message_segment = message.get('message_segment')
-            else:
-                message_segment = getattr(message, 'message_segment', None)
+            message_segment = _get_field(message, 'message_segment')
 
             if message_segment:
                 emoji_base64_list = self.find_and_return_emoji_in_message(message_segment)
@@ -587,21 +716,17 @@ class ImageProcessor:
             if not text:
                 return None
 
-            # 尝试匹配base64数据模式
-            import re
-
-            # 匹配data:image/格式的base64
-            data_url_pattern = r'data:image/[^;]+;base64,([A-Za-z0-9+/=]+)'
-            match = re.search(data_url_pattern, text)
-            if match:
-                return match.group(1)
-
-            # 匹配纯base64数据（长度较长的情况）
-            base64_pattern = r'([A-Za-z0-9+/]{100,}={0,2})'
-            matches = re.findall(base64_pattern, text)
-            for match in matches:
-                if self._is_image_data(match):
-                    return match
+            # 匹配data:image/格式的base64，先用子串判断，不含标记时不进入正则
+            if 'data:image/' in text:
+                match = _DATA_URL_RE.search(text)
+                if match:
+                    return match.group(1)
+
+            # 匹配纯base64数据（长度较长的情况），逐个扫描，命中即返回
+            for match in _BASE64_RUN_RE.finditer(text):
+                candidate = match.group(1)
+                if self._is_image_data(candidate):
+                    return candidate
 
             return None
 
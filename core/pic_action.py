@@ -1,7 +1,7 @@
 import asyncio
-import traceback
-import base64
 import os
+import random
+import re
 from typing import List, Tuple, Type, Optional, Dict, Any
 
 from src.plugin_system.base.base_action import BaseAction
@@ -9,7 +9,7 @@ from src.plugin_system.base.component_types import ActionActivationType, ChatMod
 from src.common.logger import get_logger
 
 from .api_clients import get_client_class
-from .image_utils import ImageProcessor
+from .image_utils import ImageProcessor, read_image_base64
 from .cache_manager import CacheManager
 from .size_utils import validate_image_size, get_image_size
 from .runtime_state import runtime_state
@@ -17,6 +17,96 @@ from .prompt_optimizer import optimize_prompt
 
 logger = get_logger("pic_action")
 
+# 从用户消息中提取图片描述时要移除的前缀，按顺序逐个应用
+_DESCRIPTION_PREFIX_PATTERNS = tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'^画',           # "画"
+    r'^绘制',         # "绘制"
+    r'^生成图片',     # "生成图片"
+    r'^画图',         # "画图"
+    r'^帮我画',       # "帮我画"
+    r'^请画',         # "请画"
+    r'^能不能画',     # "能不能画"
+    r'^可以画',       # "可以画"
+    r'^画一个',       # "画一个"
+    r'^画一只',       # "画一只"
+    r'^画张',         # "画张"
+    r'^画幅',         # "画幅"
+    r'^图[：:]',      # "图："或"图:"
+    r'^生成图片[：:]', # "生成图片："或"生成图片:"
+    r'^[：:]',        # 单独的冒号
+))
+
+# 要移除的常见后缀，按顺序逐个应用
+_DESCRIPTION_SUFFIX_PATTERNS = tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'图片$',         # "图片"
+    r'图$',           # "图"
+    r'一下$',         # "一下"
+    r'呗$',           # "呗"
+    r'吧$',           # "吧"
+))
+
+# 配置模板中的占位API密钥，匹配到即视为未配置
+_PLACEHOLDER_API_KEY = re.compile(r"YOUR_API_KEY_HERE|x{14}")
+
+# 自拍模式的智能手部动作库（40+种动作），未指定手部动作时从中随机选择
+_HAND_ACTIONS = (
+    # 经典手势
+    "peace sign, v sign",
+    "waving hand, friendly gesture",
+    "thumbs up, positive gesture",
+    "finger heart, cute pose",
+    "ok sign, hand gesture",
+
+    # 可爱动作
+    "touching face gently, soft expression",
+    "hand near chin, thinking pose",
+    "covering mouth with hand, shy expression",
+    "both hands on cheeks, surprised",
+    "one hand in hair, casual pose",
+
+    # 时尚姿态
+    "hand on hip, confident pose",
+    "adjusting hair, elegant gesture",
+    "fixing collar, neat appearance",
+    "checking nails, stylish pose",
+    "hand behind head, relaxed",
+
+    # 表情包系列
+    "saluting, military pose",
+    "finger gun, playful gesture",
+    "crossed arms, cool pose",
+    "hand shielding eyes, looking far",
+    "hands clasped together, pleading",
+
+    # 甜美系列
+    "blowing kiss, romantic",
+    "heart shape with hands",
+    "hugging self, content",
+    "cat paw gesture, playful",
+    "bunny ears with fingers",
+
+    # 自然动作
+    "resting chin on hand, relaxed",
+    "stretching arms, energetic",
+    "fixing glasses, nerdy",
+    "touching necklace, delicate",
+    "adjusting earring, fashionable",
+
+    # 情绪表达
+    "fist pump, excited",
+    "hands together praying, hopeful",
+    "wiping forehead, relieved",
+    "scratching head, confused",
+    "finger on lips, secretive",
+
+    # 特殊pose
+    "making frame with fingers, photographer pose",
+    "counting on fingers, cute",
+    "pointing at viewer, engaging",
+    "covering one eye, mysterious",
+    "both hands up, surprised reaction",
+)
+
 class Custom_Pic_Action(BaseAction):
     """统一的图片生成动作，智能检测文生图或图生图"""
 
@@ -186,6 +276,9 @@ class Custom_Pic_Action(BaseAction):
         except (ValueError, TypeError):
             strength = 0.7
 
+        # 模型配置只查询一次，自拍、图生图和文生图分支共用
+        model_config = self._get_model_config(model_id)
+
         # 处理自拍模式
         if selfie_mode:
             # 检查自拍功能是否启用
@@ -199,13 +292,14 @@ class Custom_Pic_Action(BaseAction):
             logger.info(f"{self.log_prefix} 自拍模式处理后的提示词: {description[:100]}...")
 
             # 检查是否配置了参考图片
-            reference_image = self._get_selfie_reference_image()
+            reference_image = await self._get_selfie_reference_image()
             if reference_image:
                 # 检查模型是否支持图生图
-                model_config = self._get_model_config(model_id)
                 if model_config and model_config.get("support_img2img", True):
                     logger.info(f"{self.log_prefix} 使用自拍参考图片进行图生图")
-                    return await self._execute_unified_generation(description, model_id, size, strength or 0.6, reference_image)
+                    return await self._execute_unified_generation(
+                        description, model_id, size, strength or 0.6, reference_image, model_config=model_config
+                    )
                 else:
                     logger.warning(f"{self.log_prefix} 模型 {model_id} 不支持图生图，自拍回退为文生图模式")
             # 无参考图或模型不支持，继续使用文生图
@@ -216,48 +310,44 @@ class Custom_Pic_Action(BaseAction):
 
         if is_img2img_mode:
             # 检查指定模型是否支持图生图
-            model_config = self._get_model_config(model_id)
             if model_config and not model_config.get("support_img2img", True):
                 logger.warning(f"{self.log_prefix} 模型 {model_id} 不支持图生图，转为文生图模式")
                 await self.send_text(f"当前模型 {model_id} 不支持图生图功能，将为您生成新图片")
-                return await self._execute_unified_generation(description, model_id, size, None, None)
+                return await self._execute_unified_generation(description, model_id, size, None, None, model_config=model_config)
 
             logger.info(f"{self.log_prefix} 检测到输入图片，使用图生图模式")
-            return await self._execute_unified_generation(description, model_id, size, strength, input_image_base64)
+            return await self._execute_unified_generation(
+                description, model_id, size, strength, input_image_base64, model_config=model_config
+            )
         else:
             logger.info(f"{self.log_prefix} 未检测到输入图片，使用文生图模式")
-            return await self._execute_unified_generation(description, model_id, size, None, None)
-
-    async def _execute_unified_generation(self, description: str, model_id: str, size: str, strength: float = None, input_image_base64: str = None) -> Tuple[bool, Optional[str]]:
-        """统一的图片生成执行方法"""
+            return await self._execute_unified_generation(description, model_id, size, None, None, model_config=model_config)
+
+    async def _execute_unified_generation(
+        self,
+        description: str,
+        model_id: str,
+        size: str,
+        strength: float = None,
+        input_image_base64: str = None,
+        model_config: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[bool, Optional[str]]:
+        """统一的图片生成执行方法
+
+        调用方已经获取过模型配置时可通过model_config传入，避免重复查询配置
+        """
 
         # 获取模型配置
-        model_config = self._get_model_config(model_id)
+        if model_config is None:
+            model_config = self._get_model_config(model_id)
         if not model_config:
             error_msg = f"指定的模型 '{model_id}' 不存在或配置无效，请检查配置文件。"
             await self.send_text(error_msg)
             logger.error(f"{self.log_prefix} 模型配置获取失败: {model_id}")
             return False, "模型配置无效"
 
-        # 配置验证
-        http_base_url = model_config.get("base_url")
-        http_api_key = model_config.get("api_key")
-        if not (http_base_url and http_api_key):
-            error_msg = "抱歉，图片生成功能所需的HTTP配置（如API地址或密钥）不完整，无法提供服务。"
-            await self.send_text(error_msg)
-            logger.error(f"{self.log_prefix} HTTP调用配置缺失: base_url 或 api_key.")
-            return False, "HTTP配置不完整"
-
-        # API密钥验证
-        if "YOUR_API_KEY_HERE" in http_api_key or "xxxxxxxxxxxxxx" in http_api_key:
-            error_msg = "图片生成功能尚未配置，请设置正确的API密钥。"
-            await self.send_text(error_msg)
-            logger.error(f"{self.log_prefix} API密钥未配置")
-            return False, "API密钥未配置"
-
         # 获取模型配置参数
         model_name = model_config.get("model", "default-model")
-        api_format = model_config.get("format", "openai")
 
         # 使用统一的尺寸处理逻辑
         image_size, llm_original_size = get_image_size(model_config, size, self.log_prefix)
@@ -267,13 +357,15 @@ class Custom_Pic_Action(BaseAction):
             logger.warning(f"{self.log_prefix} 无效的图片尺寸: {image_size}，使用模型默认值")
             image_size = model_config.get("default_size", "1024x1024")
 
-        # 检查缓存
+        # 调试信息开关在本次生成中只读取一次
+        enable_debug = self.get_config("components.enable_debug_info", False)
+
+        # 检查缓存（命中时无需请求API，先于HTTP配置验证进行）
         is_img2img = input_image_base64 is not None
         cached_result = self.cache_manager.get_cached_result(description, model_name, image_size, strength, is_img2img)
 
         if cached_result:
             logger.info(f"{self.log_prefix} 使用缓存的图片结果")
-            enable_debug = self.get_config("components.enable_debug_info", False)
             if enable_debug:
                 await self.send_text("我之前画过类似的图片，用之前的结果~")
             send_success = await self.send_image(cached_result)
@@ -282,8 +374,25 @@ class Custom_Pic_Action(BaseAction):
             else:
                 self.cache_manager.remove_cached_result(description, model_name, image_size, strength, is_img2img)
 
+        # 配置验证
+        http_base_url = model_config.get("base_url")
+        http_api_key = model_config.get("api_key")
+        if not (http_base_url and http_api_key):
+            error_msg = "抱歉，图片生成功能所需的HTTP配置（如API地址或密钥）不完整，无法提供服务。"
+            await self.send_text(error_msg)
+            logger.error(f"{self.log_prefix} HTTP调用配置缺失: base_url 或 api_key.")
+            return False, "HTTP配置不完整"
+
+        # API密钥验证
+        if _PLACEHOLDER_API_KEY.search(http_api_key):
+            error_msg = "图片生成功能尚未配置，请设置正确的API密钥。"
+            await self.send_text(error_msg)
+            logger.error(f"{self.log_prefix} API密钥未配置")
+            return False, "API密钥未配置"
+
+        api_format = model_config.get("format", "openai")
+
         # 显示处理信息
-        enable_debug = self.get_config("components.enable_debug_info", False)
         if enable_debug:
             mode_text = "图生图" if is_img2img else "文生图"
             await self.send_text(
@@ -301,17 +410,23 @@ class Custom_Pic_Action(BaseAction):
 
             # 获取对应格式的API客户端并调用
             api_client = self._get_api_client(api_format)
-            success, result = await api_client.generate_image(
-                prompt=description,
-                model_config=model_config,
-                size=image_size,
-                strength=strength,
-                input_image_base64=input_image_base64,
-                max_retries=max_retries
+            # 与Command组件共用并发闸门，超出上限的请求排队等待
+            gen_semaphore = runtime_state.get_generation_semaphore(
+                self.get_config("components.max_concurrency", 5)
             )
+            if gen_semaphore.locked():
+                logger.info(f"{self.log_prefix} 生成并发已达上限，排队等待中")
+            async with gen_semaphore:
+                success, result = await api_client.generate_image(
+                    prompt=description,
+                    model_config=model_config,
+                    size=image_size,
+                    strength=strength,
+                    input_image_base64=input_image_base64,
+                    max_retries=max_retries
+                )
         except Exception as e:
             logger.error(f"{self.log_prefix} 异步请求执行失败: {e!r}", exc_info=True)
-            traceback.print_exc()
             success = False
             result = f"图片生成服务遇到意外问题: {str(e)[:100]}"
 
@@ -335,8 +450,8 @@ class Custom_Pic_Action(BaseAction):
                         return False, "图片发送失败"
                 else:  # URL
                     try:
-                        encode_success, encode_result = await asyncio.to_thread(
-                            self.image_processor.download_and_encode_base64, final_image_data
+                        encode_success, encode_result = await self.image_processor.download_and_encode_base64(
+                            final_image_data
                         )
                         if encode_success:
                             send_success = await self.send_image(encode_result)
@@ -399,8 +514,6 @@ class Custom_Pic_Action(BaseAction):
         Returns:
             处理后的完整提示词
         """
-        import random
-
         # 1. 添加强制主体设置
         forced_subject = "(1girl:1.4), (solo:1.3)"
 
@@ -415,76 +528,17 @@ class Custom_Pic_Action(BaseAction):
             # 标准自拍风格（适用于户外或无镜子场景，前置摄像头视角）
             selfie_scene = "selfie, front camera view, arm extended, looking at camera"
 
-        # 4. 智能手部动作库（40+种动作）
-        hand_actions = [
-            # 经典手势
-            "peace sign, v sign",
-            "waving hand, friendly gesture",
-            "thumbs up, positive gesture",
-            "finger heart, cute pose",
-            "ok sign, hand gesture",
-
-            # 可爱动作
-            "touching face gently, soft expression",
-            "hand near chin, thinking pose",
-            "covering mouth with hand, shy expression",
-            "both hands on cheeks, surprised",
-            "one hand in hair, casual pose",
-
-            # 时尚姿态
-            "hand on hip, confident pose",
-            "adjusting hair, elegant gesture",
-            "fixing collar, neat appearance",
-            "checking nails, stylish pose",
-            "hand behind head, relaxed",
-
-            # 表情包系列
-            "saluting, military pose",
-            "finger gun, playful gesture",
-            "crossed arms, cool pose",
-            "hand shielding eyes, looking far",
-            "hands clasped together, pleading",
-
-            # 甜美系列
-            "blowing kiss, romantic",
-            "heart shape with hands",
-            "hugging self, content",
-            "cat paw gesture, playful",
-            "bunny ears with fingers",
-
-            # 自然动作
-            "resting chin on hand, relaxed",
-            "stretching arms, energetic",
-            "fixing glasses, nerdy",
-            "touching necklace, delicate",
-            "adjusting earring, fashionable",
-
-            # 情绪表达
-            "fist pump, excited",
-            "hands together praying, hopeful",
-            "wiping forehead, relieved",
-            "scratching head, confused",
-            "finger on lips, secretive",
-
-            # 特殊pose
-            "making frame with fingers, photographer pose",
-            "counting on fingers, cute",
-            "pointing at viewer, engaging",
-            "covering one eye, mysterious",
-            "both hands up, surprised reaction"
-        ]
-
-        # 5. 选择手部动作
+        # 4. 选择手部动作
         if free_hand_action:
             # 优先使用LLM生成的手部动作
             logger.info(f"{self.log_prefix} 使用LLM生成的手部动作: {free_hand_action}")
             hand_action = free_hand_action
         else:
             # 兜底：随机选择一个手部动作
-            hand_action = random.choice(hand_actions)
+            hand_action = random.choice(_HAND_ACTIONS)
             logger.info(f"{self.log_prefix} 随机选择手部动作: {hand_action}")
 
-        # 6. 组装完整提示词
+        # 5. 组装完整提示词
         # 格式：强制主体 + Bot形象 + 手部动作 + 自拍场景 + 用户描述
         prompt_parts = [forced_subject]
 
@@ -497,26 +551,21 @@ class Custom_Pic_Action(BaseAction):
             description
         ])
 
-        # 7. 合并并去重
-        final_prompt = ", ".join(prompt_parts)
-
-        # 8. 简单的去重处理（避免重复关键词）
-        # 将提示词拆分，去除重复的关键词组合
-        keywords = [kw.strip() for kw in final_prompt.split(',')]
-        seen = set()
-        unique_keywords = []
-        for kw in keywords:
-            kw_lower = kw.lower()
-            if kw_lower not in seen and kw:
-                seen.add(kw_lower)
-                unique_keywords.append(kw)
+        # 6. 去重后合并（避免重复关键词）
+        # 直接逐段拆分关键词，按小写去重并保留首次出现的写法和顺序
+        unique_keywords: Dict[str, str] = {}
+        for part in prompt_parts:
+            for kw in part.split(','):
+                kw = kw.strip()
+                if kw:
+                    unique_keywords.setdefault(kw.lower(), kw)
 
-        final_prompt = ", ".join(unique_keywords)
+        final_prompt = ", ".join(unique_keywords.values())
 
         logger.info(f"{self.log_prefix} 自拍模式最终提示词: {final_prompt[:200]}...")
         return final_prompt
 
-    def _get_selfie_reference_image(self) -> Optional[str]:
+    async def _get_selfie_reference_image(self) -> Optional[str]:
         """获取自拍参考图片的base64编码
 
         Returns:
@@ -532,15 +581,14 @@ class Custom_Pic_Action(BaseAction):
                 plugin_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
                 image_path = os.path.join(plugin_dir, image_path)
 
-            if os.path.exists(image_path):
-                with open(image_path, 'rb') as f:
-                    image_data = f.read()
-                image_base64 = base64.b64encode(image_data).decode('utf-8')
-                logger.info(f"{self.log_prefix} 从文件加载自拍参考图片: {image_path}")
-                return image_base64
-            else:
-                logger.warning(f"{self.log_prefix} 自拍参考图片文件不存在: {image_path}")
-                return None
+            # 直接stat，文件不存在时由异常处理，省去单独的exists检查
+            # 参考图片每次自拍都会用到，按修改时间缓存编码结果；读盘放到线程中执行，不阻塞事件循环
+            image_base64 = await asyncio.to_thread(read_image_base64, image_path)
+            logger.info(f"{self.log_prefix} 从文件加载自拍参考图片: {image_path}")
+            return image_base64
+        except FileNotFoundError:
+            logger.warning(f"{self.log_prefix} 自拍参考图片文件不存在: {image_path}")
+            return None
         except Exception as e:
             logger.error(f"{self.log_prefix} 加载自拍参考图片失败: {e}")
             return None
@@ -680,42 +728,13 @@ class Custom_Pic_Action(BaseAction):
         if not message_text:
             return ""
             
-        import re
-        
-        # 移除常见的画图相关前缀
-        patterns_to_remove = [
-            r'^画',           # "画"
-            r'^绘制',         # "绘制"
-            r'^生成图片',     # "生成图片"
-            r'^画图',         # "画图"
-            r'^帮我画',       # "帮我画"
-            r'^请画',         # "请画"
-            r'^能不能画',     # "能不能画"
-            r'^可以画',       # "可以画"
-            r'^画一个',       # "画一个"
-            r'^画一只',       # "画一只"
-            r'^画张',         # "画张"
-            r'^画幅',         # "画幅"
-            r'^图[：:]',      # "图："或"图:"
-            r'^生成图片[：:]', # "生成图片："或"生成图片:"
-            r'^[：:]',        # 单独的冒号
-        ]
-        
+        # 依次移除常见的画图相关前缀和后缀（正则在模块加载时预编译）
         cleaned_text = message_text
-        for pattern in patterns_to_remove:
-            cleaned_text = re.sub(pattern, '', cleaned_text, flags=re.IGNORECASE)
-        
-        # 移除常见的后缀
-        suffix_patterns = [
-            r'图片$',         # "图片"
-            r'图$',           # "图"
-            r'一下$',         # "一下"
-            r'呗$',           # "呗"
-            r'吧$',           # "吧"
-        ]
-        
-        for pattern in suffix_patterns:
-            cleaned_text = re.sub(pattern, '', cleaned_text, flags=re.IGNORECASE)
+        for pattern in _DESCRIPTION_PREFIX_PATTERNS:
+            cleaned_text = pattern.sub('', cleaned_text)
+
+        for pattern in _DESCRIPTION_SUFFIX_PATTERNS:
+            cleaned_text = pattern.sub('', cleaned_text)
         
         # 清理空白字符
         cleaned_text = cleaned_text.strip()
@@ -6,13 +6,31 @@ from src.plugin_system.base.base_command import BaseCommand
 from src.common.logger import get_logger
 
 from .api_clients import ApiClient
-from .image_utils import ImageProcessor
+from .image_utils import ImageProcessor, encode_base64
 from .runtime_state import runtime_state
 from .prompt_optimizer import optimize_prompt
 from .size_utils import get_image_size_async
 
 logger = get_logger("pic_command")
 
+# 自然语言中指定模型的匹配模式：用/使用 + model/模型 + 数字/ID，按优先级依次查找
+_MODEL_ID_PATTERNS = tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'(?:用|使用)\s*(model\d+)',  # 用model1, 使用model2
+    r'(?:用|使用)\s*(?:模型|型号)\s*(\d+)',  # 用模型1, 使用型号2
+))
+# 以model1开头的描述，仅在没有显式"用/使用"指定时作为兜底
+_MODEL_PREFIX_RE = re.compile(r'model\d+', re.IGNORECASE)
+
+# 从描述中移除模型指定部分的模式
+_MODEL_REMOVE_PATTERNS = tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'(?:用|使用)\s*model\d+\s*(?:画|生成|创作)?',
+    r'(?:用|使用)\s*(?:模型|型号)\s*\d+\s*(?:画|生成|创作)?',
+    r'^model\d+\s*(?:画|生成|创作)?',
+))
+
+# 判断输入为自然语言描述的动作词
+_ACTION_WORDS = ('画', '生成', '绘制', '创作', '制作', '画成', '变成', '改成', '用', '来', '帮我', '给我')
+
 class PicGenerationCommand(BaseCommand):
     """图生图Command组件，支持通过命令进行图生图，可选择特定模型"""
 
@@ -82,8 +100,7 @@ class PicGenerationCommand(BaseCommand):
 
         # 步骤2：配置中没有该风格，判断是否是自然语言
         # 检测自然语言特征
-        action_words = ['画', '生成', '绘制', '创作', '制作', '画成', '变成', '改成', '用', '来', '帮我', '给我']
-        has_action_word = any(word in content for word in action_words)
+        has_action_word = any(word in content for word in _ACTION_WORDS)
         is_long_text = len(content) > 6
 
         if has_action_word or is_long_text:
@@ -157,14 +174,21 @@ class PicGenerationCommand(BaseCommand):
 
             # 调用API客户端生成图片
             api_client = ApiClient(self)
-            success, result = await api_client.generate_image(
-                prompt=final_description,
-                model_config=model_config,
-                size=image_size,
-                strength=0.7,  # 默认强度
-                input_image_base64=input_image_base64,
-                max_retries=max_retries
+            # 与Action组件共用并发闸门，超出上限的请求排队等待
+            gen_semaphore = runtime_state.get_generation_semaphore(
+                self.get_config("components.max_concurrency", 5)
             )
+            if gen_semaphore.locked():
+                logger.info(f"{self.log_prefix} 生成并发已达上限，排队等待中")
+            async with gen_semaphore:
+                success, result = await api_client.generate_image(
+                    prompt=final_description,
+                    model_config=model_config,
+                    size=image_size,
+                    strength=0.7,  # 默认强度
+                    input_image_base64=input_image_base64,
+                    max_retries=max_retries
+                )
 
             if success:
                 # 处理结果
@@ -299,14 +323,21 @@ class PicGenerationCommand(BaseCommand):
 
             # 调用API客户端生成图片
             api_client = ApiClient(self)
-            success, result = await api_client.generate_image(
-                prompt=description,
-                model_config=model_config,
-                size=image_size,
-                strength=0.7 if is_img2img_mode else None,
-                input_image_base64=input_image_base64,
-                max_retries=max_retries
+            # 与Action组件共用并发闸门，超出上限的请求排队等待
+            gen_semaphore = runtime_state.get_generation_semaphore(
+                self.get_config("components.max_concurrency", 5)
             )
+            if gen_semaphore.locked():
+                logger.info(f"{self.log_prefix} 生成并发已达上限，排队等待中")
+            async with gen_semaphore:
+                success, result = await api_client.generate_image(
+                    prompt=description,
+                    model_config=model_config,
+                    size=image_size,
+                    strength=0.7 if is_img2img_mode else None,
+                    input_image_base64=input_image_base64,
+                    max_retries=max_retries
+                )
 
             if success:
                 # 处理结果
@@ -363,15 +394,8 @@ class PicGenerationCommand(BaseCommand):
         - model1画...
         - 使用model2...
         """
-        # 匹配模式：用/使用 + model/模型 + 数字/ID
-        patterns = [
-            r'(?:用|使用)\s*(model\d+)',  # 用model1, 使用model2
-            r'(?:用|使用)\s*(?:模型|型号)\s*(\d+)',  # 用模型1, 使用型号2
-            r'^(model\d+)',  # model1开头
-        ]
-
-        for pattern in patterns:
-            match = re.search(pattern, description, re.IGNORECASE)
+        for pattern in _MODEL_ID_PATTERNS:
+            match = pattern.search(description)
             if match:
                 model_id = match.group(1)
                 # 如果匹配到数字，转换为modelX格式
@@ -379,19 +403,17 @@ class PicGenerationCommand(BaseCommand):
                     model_id = f"model{model_id}"
                 return model_id.lower()
 
+        # 开头的model1只需在起始位置尝试匹配，无需扫描全文
+        match = _MODEL_PREFIX_RE.match(description)
+        if match:
+            return match.group(0).lower()
+
         return None
 
     def _remove_model_pattern(self, description: str) -> str:
         """移除描述中的模型指定部分"""
-        # 移除模式
-        patterns = [
-            r'(?:用|使用)\s*model\d+\s*(?:画|生成|创作)?',
-            r'(?:用|使用)\s*(?:模型|型号)\s*\d+\s*(?:画|生成|创作)?',
-            r'^model\d+\s*(?:画|生成|创作)?',
-        ]
-
-        for pattern in patterns:
-            description = re.sub(pattern, '', description, flags=re.IGNORECASE)
+        for pattern in _MODEL_REMOVE_PATTERNS:
+            description = pattern.sub('', description)
 
         return description.strip()
 
@@ -450,7 +472,6 @@ class PicGenerationCommand(BaseCommand):
         """下载图片并转换为base64编码"""
         try:
             import requests
-            import base64
 
             # 获取代理配置
             proxy_enabled = self.get_config("proxy.enabled", False)
@@ -469,7 +490,7 @@ class PicGenerationCommand(BaseCommand):
 
             response = requests.get(**request_kwargs)
             if response.status_code == 200:
-                image_base64 = base64.b64encode(response.content).decode('utf-8')
+                image_base64 = encode_base64(response.content)
                 return True, image_base64
             else:
                 return False, f"HTTP {response.status_code}"
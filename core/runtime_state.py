@@ -5,7 +5,10 @@
 - 模型开关
 - 撤回开关
 - 默认模型设置
+
+另外维护所有聊天流共享的图片生成并发闸门。
 """
+import asyncio
 from typing import Dict, Any, Optional, Set
 from dataclasses import dataclass, field
 from src.common.logger import get_logger
@@ -40,6 +43,7 @@ class RuntimeStateManager:
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             cls._instance._states: Dict[str, ChatStreamState] = {}
+            cls._instance._generation_semaphore: Optional[asyncio.Semaphore] = None
         return cls._instance
 
     def _get_state(self, chat_id: str) -> ChatStreamState:
@@ -172,6 +176,18 @@ class RuntimeStateManager:
         state.command_default_model = None
         logger.info(f"[RuntimeState] 聊天流 {chat_id} Command默认模型已重置为全局配置")
 
+    # ==================== 生成并发 ====================
+
+    def get_generation_semaphore(self, max_concurrency: int) -> asyncio.Semaphore:
+        """获取Action与Command共用的图片生成并发闸门
+
+        首次调用时按传入的上限创建，之后修改配置需重启才会生效。
+        """
+        if self._generation_semaphore is None:
+            self._generation_semaphore = asyncio.Semaphore(max(1, max_concurrency))
+            logger.info(f"[RuntimeState] 图片生成并发上限: {max(1, max_concurrency)}")
+        return self._generation_semaphore
+
     # ==================== 状态重置 ====================
 
     def reset_chat_state(self, chat_id: str) -> None:
@@ -2,11 +2,16 @@
 
 提供统一的图片尺寸解析、验证和转换功能，供各API客户端复用
 """
+import re
+from functools import lru_cache
 from typing import Tuple, Optional, Dict
 from src.common.logger import get_logger
 
 logger = get_logger("pic_action")
 
+# 像素尺寸格式：1024x1024、1024X1024、1024*1024（分隔符两侧允许空白）
+_PIXEL_SIZE_RE = re.compile(r'^\s*(\d+)\s*[xX*]\s*(\d+)\s*$')
+
 # LLM 尺寸选择系统提示词
 SIZE_SELECTOR_SYSTEM_PROMPT = """You are an image size selector. Based on the image description, choose the most appropriate size.
 
@@ -217,20 +222,12 @@ def parse_pixel_size(size: str, default_width: int = 1024, default_height: int =
     if not size or not isinstance(size, str):
         return default_width, default_height
 
-    size_lower = size.lower().strip()
-
-    # 尝试解析 "WxH" 或 "W*H" 格式
-    for separator in ['x', '*']:
-        if separator in size_lower:
-            try:
-                parts = size_lower.split(separator)
-                if len(parts) == 2:
-                    width = int(parts[0].strip())
-                    height = int(parts[1].strip())
-                    if width > 0 and height > 0:
-                        return width, height
-            except (ValueError, IndexError):
-                pass
+    # 解析 "WxH" 或 "W*H" 格式，一次匹配同时取出宽高
+    match = _PIXEL_SIZE_RE.match(size)
+    if match:
+        width, height = int(match.group(1)), int(match.group(2))
+        if width > 0 and height > 0:
+            return width, height
 
     return default_width, default_height
 
@@ -253,8 +250,12 @@ def validate_image_size(size: str) -> bool:
     if not size or not isinstance(size, str):
         return False
 
-    size = size.strip()
+    return _validate_size_string(size.strip())
+
 
+@lru_cache(maxsize=32)
+def _validate_size_string(size: str) -> bool:
+    """validate_image_size 的缓存实现，常用尺寸重复校验时直接命中缓存"""
     try:
         # 格式1：仅分辨率（-2K、-4K）
         if size.startswith('-'):
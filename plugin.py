@@ -22,11 +22,11 @@ class CustomPicPlugin(BasePlugin):
 
     # 插件基本信息
     plugin_name = "custom_pic_plugin"
-    plugin_version = "3.3.3"
+    plugin_version = "3.3.4"
     plugin_author = "Ptrel，Rabbit"
     enable_plugin = True
     dependencies: List[str] = []
-    python_dependencies: List[str] = []
+    python_dependencies: List[str] = ["aiohttp"]
     config_file_name = "config.toml"
 
     # 配置节元数据
@@ -160,7 +160,7 @@ class CustomPicPlugin(BasePlugin):
             ),
             "config_version": ConfigField(
                 type=str,
-                default="3.3.3",
+                default="3.3.4",
                 description="插件配置版本号",
                 disabled=True,
                 order=2
@@ -257,6 +257,14 @@ class CustomPicPlugin(BasePlugin):
                 min=0,
                 max=10,
                 order=9
+            ),
+            "max_concurrency": ConfigField(
+                type=int,
+                default=5,
+                description="同时进行的图片生成请求上限（Action与/dr命令共用），超出的请求会排队等待。修改后需重启生效",
+                min=1,
+                max=20,
+                order=10
             )
         },
         "logging": {